@@ -1,13 +1,23 @@
 import psycopg2
 import logging
 import os
-import pandas as pd
+import sys
+import csv
 import json
-from flask import Flask, request, render_template, jsonify
+import gzip
+import hashlib
+import re
+import base64
+import click
+from flask import Flask, request, render_template, jsonify, g, send_from_directory, Response
 from flask_cors import CORS
 import uuid
 import datetime
 import time
+import hmac
+import math
+import threading
+from collections import Counter
 from pathlib import Path
 
 logging.basicConfig(
@@ -77,9 +87,346 @@ def get_db_connection(db_name):
 
 @app.before_request
 def log_request_info():
-    logging.info('Headers: %s', request.headers)
+    headers = {k: ('<redacted>' if k.lower() == PROFILE_HEADER.lower() else v) for k, v in request.headers.items()}
+    logging.info('Headers: %s', headers)
     logging.info('Body: %s', request.get_data())
 
+# ==========================
+# On-Demand Profiling
+# ==========================
+# Off unless QUOTE_PROFILE_THRESHOLD_MS (auto-capture of slow requests) or
+# QUOTE_PROFILE_TOKEN (per-request opt-in via the X-Quote-Profile header) is set.
+PROFILE_DIR = Path(os.environ.get("QUOTE_PROFILE_DIR", "/home/ubuntu/scribe/quote/profiles"))
+PROFILE_THRESHOLD_MS = float(os.environ.get("QUOTE_PROFILE_THRESHOLD_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("QUOTE_PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_FILES = int(os.environ.get("QUOTE_PROFILE_MAX_FILES", "50"))
+PROFILE_TOKEN = os.environ.get("QUOTE_PROFILE_TOKEN", "")
+PROFILE_HEADER = "X-Quote-Profile"
+PROFILING_ENABLED = PROFILE_THRESHOLD_MS > 0 or bool(PROFILE_TOKEN)
+
+
+def collapse_stack(frame):
+    """Render a frame chain root-first in collapsed-stack ("a;b;c") form."""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class StackSampler:
+    """
+    One background thread that periodically samples the stacks of every
+    request thread currently registered for profiling. It sleeps on an event
+    while nothing is registered, so idle workers pay nothing.
+    """
+
+    def __init__(self, interval_seconds):
+        self.interval = interval_seconds
+        self.lock = threading.Lock()
+        self.active = {}  # thread ident -> Counter of collapsed stacks
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self, ident):
+        counts = Counter()
+        with self.lock:
+            self.active[ident] = counts
+            self.wakeup.set()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="quote-profiler", daemon=True)
+                self.thread.start()
+        return counts
+
+    def stop(self, ident):
+        with self.lock:
+            return self.active.pop(ident, None)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    self.wakeup.clear()
+                    continue
+                frames = sys._current_frames()
+                for ident, counts in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        counts[collapse_stack(frame)] += 1
+
+
+profile_sampler = StackSampler(PROFILE_INTERVAL_MS / 1000.0)
+
+
+def write_profile(counts, label):
+    """Write collapsed stacks to the profile ring, evicting the oldest files."""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}.folded"
+    with open(PROFILE_DIR / name, 'w') as f:
+        for stack, count in counts.most_common():
+            f.write(f"{stack} {count}\n")
+
+    profiles = sorted(PROFILE_DIR.glob("*.folded"))
+    for old in profiles[:max(len(profiles) - PROFILE_MAX_FILES, 0)]:
+        old.unlink(missing_ok=True)
+    return name
+
+
+def profile_opt_in():
+    token = request.headers.get(PROFILE_HEADER)
+    return bool(PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN))
+
+
+def is_admin_request():
+    """
+    Admin routes need a local caller and, when QUOTE_PROFILE_TOKEN is set, the
+    token in the X-Quote-Profile header. Behind a same-host reverse proxy every
+    client looks local, so set the token in that setup.
+    """
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return False
+    return not PROFILE_TOKEN or profile_opt_in()
+
+
+@app.before_request
+def start_profiling():
+    if not PROFILING_ENABLED:
+        return
+    # Admin calls carry the token for auth, not as a profiling opt-in; they
+    # must not push real slow-request profiles out of the ring.
+    if request.path.startswith('/admin/'):
+        return
+    forced = profile_opt_in()
+    if not forced and PROFILE_THRESHOLD_MS <= 0:
+        return
+    g.profile_forced = forced
+    g.profile_start = time.time()
+    g.profile_counts = profile_sampler.start(threading.get_ident())
+
+
+@app.after_request
+def finish_profiling(response):
+    counts = g.pop('profile_counts', None)
+    if counts is None:
+        return response
+    profile_sampler.stop(threading.get_ident())
+    elapsed_ms = (time.time() - g.profile_start) * 1000
+    slow = PROFILE_THRESHOLD_MS > 0 and elapsed_ms >= PROFILE_THRESHOLD_MS
+    if not (g.profile_forced or slow) or not counts:
+        return response
+    try:
+        label = f"{request.endpoint or 'unknown'}-{elapsed_ms:.0f}ms"
+        name = write_profile(counts, label)
+        logging.info(f"[PROFILE] {request.path} took {elapsed_ms:.0f} ms, wrote {name}")
+        if g.profile_forced:
+            response.headers['X-Quote-Profile-Id'] = name
+    except Exception as e:
+        logging.error(f"[PROFILE] Error writing profile: {e}")
+    return response
+
+
+@app.teardown_request
+def cleanup_profiling(exc):
+    # after_request is skipped on unhandled errors; make sure we stop sampling.
+    if PROFILING_ENABLED:
+        profile_sampler.stop(threading.get_ident())
+
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """List captured profiles (newest first). Local requests only."""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    try:
+        profiles = []
+        if PROFILE_DIR.exists():
+            for path in sorted(PROFILE_DIR.glob("*.folded"), reverse=True):
+                stat = path.stat()
+                profiles.append({
+                    "name": path.name,
+                    "size": stat.st_size,
+                    "created": datetime.datetime.fromtimestamp(stat.st_mtime).isoformat()
+                })
+        return jsonify({'profiles': profiles}), 200
+    except Exception as e:
+        logging.error(f"Error listing profiles: {e}")
+        return jsonify({'error': 'Failed to list profiles.'}), 500
+
+
+@app.route('/admin/profiles/<name>', methods=['GET'])
+def get_profile(name):
+    """Download one profile in collapsed-stack format (speedscope can open it)."""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return send_from_directory(PROFILE_DIR, name, mimetype='text/plain')
+
+# ==========================
+# Admission Control
+# ==========================
+# Each gate caps how many requests of a route class run at once. Extra
+# requests wait in a bounded queue until their deadline and are then shed
+# with 503 + Retry-After, so a slow Postgres can't tie up every worker and
+# starve the cheap lookup routes. Limits of 0 disable a gate.
+class AdmissionGate:
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout, per_key_limit=0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.per_key_limit = per_key_limit
+        self.cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.per_key = Counter()  # locationID -> queued + running requests
+        self.admitted = 0
+        self.shed = Counter()     # reason -> count
+
+    def _drop_key(self, key):
+        if key:
+            self.per_key[key] -= 1
+            if self.per_key[key] <= 0:
+                del self.per_key[key]
+
+    def _reject(self, reason):
+        self.shed[reason] += 1
+        return reason
+
+    def acquire(self, key=None):
+        """Return None once admitted, otherwise the reason the request was shed."""
+        with self.cond:
+            if self.active >= self.max_concurrent:
+                # Fair share only matters once the gate is saturated: a location
+                # already holding its share of slots/queue can't queue more.
+                if key and self.per_key_limit and self.per_key[key] >= self.per_key_limit:
+                    return self._reject('fair_share')
+                if self.waiting >= self.max_queue:
+                    return self._reject('queue_full')
+                deadline = time.monotonic() + self.queue_timeout
+                self.waiting += 1
+                if key:
+                    self.per_key[key] += 1
+                try:
+                    while self.active >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._drop_key(key)
+                            return self._reject('timeout')
+                        self.cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            elif key:
+                self.per_key[key] += 1
+            self.active += 1
+            self.admitted += 1
+            return None
+
+    def release(self, key=None):
+        with self.cond:
+            self.active -= 1
+            self._drop_key(key)
+            self.cond.notify()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "active": self.active,
+                "queue_depth": self.waiting,
+                "admitted": self.admitted,
+                "shed": dict(self.shed),
+                "shed_total": sum(self.shed.values())
+            }
+
+
+admission_gates = {
+    # Routes that hit Postgres.
+    'quote': AdmissionGate(
+        'quote',
+        max_concurrent=int(os.environ.get("QUOTE_ADMISSION_LIMIT", "8")),
+        max_queue=int(os.environ.get("QUOTE_ADMISSION_QUEUE", "16")),
+        queue_timeout=float(os.environ.get("QUOTE_ADMISSION_TIMEOUT", "2.0")),
+        per_key_limit=int(os.environ.get("QUOTE_ADMISSION_PER_LOCATION", "0"))
+    ),
+    # In-memory typeahead/condition lookups.
+    'lookup': AdmissionGate(
+        'lookup',
+        max_concurrent=int(os.environ.get("LOOKUP_ADMISSION_LIMIT", "32")),
+        max_queue=int(os.environ.get("LOOKUP_ADMISSION_QUEUE", "32")),
+        queue_timeout=float(os.environ.get("LOOKUP_ADMISSION_TIMEOUT", "0.5"))
+    ),
+}
+
+# endpoint -> (gate name, methods it applies to)
+ADMISSION_ROUTES = {
+    'index': ('quote', {'POST'}),
+    'get_quotes_api': ('quote', {'POST'}),
+    'get_conditions_json': ('lookup', {'GET'}),
+    'search_conditions_json': ('lookup', {'GET'}),
+    'get_condition_questions_json': ('lookup', {'POST'}),
+    'get_conditions_csv': ('lookup', {'GET'}),
+    'search_conditions_csv': ('lookup', {'GET'}),
+    'check_eligibility_csv': ('lookup', {'POST'}),
+}
+
+
+def request_location_id():
+    location_id = request.args.get('locationID') or request.form.get('locationID')
+    if not location_id and request.is_json:
+        location_id = (request.get_json(silent=True) or {}).get('locationID')
+    return location_id
+
+
+@app.before_request
+def admit_request():
+    route = ADMISSION_ROUTES.get(request.endpoint)
+    if route is None or request.method not in route[1]:
+        return
+    gate = admission_gates[route[0]]
+    if gate.max_concurrent <= 0:
+        return
+    if request.endpoint == 'get_quotes_api':
+        # Shard hits never touch Postgres, so they don't need a quote slot.
+        data = request.get_json(silent=True)
+        if isinstance(data, dict) and quote_shard_path_for(data):
+            return
+    key = request_location_id() if gate.per_key_limit else None
+    reason = gate.acquire(key)
+    if reason is not None:
+        logging.warning(f"[ADMISSION] Shed {request.path} from gate '{gate.name}' ({reason}, location={key})")
+        if request.endpoint == 'index':
+            # Keep the quoting page usable instead of replacing it with JSON.
+            response = app.make_response(render_template(
+                'index.html',
+                error='We are handling a lot of quotes right now. Please try again in a moment.',
+                location_id=request_location_id()
+            ))
+        else:
+            response = jsonify({'error': 'Server busy, please retry.'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, math.ceil(gate.queue_timeout)))
+        return response
+    g.admission = (gate, key)
+
+
+@app.teardown_request
+def release_admission(exc):
+    admission = g.pop('admission', None)
+    if admission is not None:
+        gate, key = admission
+        gate.release(key)
+
+
+@app.route('/admin/admission', methods=['GET'])
+def get_admission_metrics():
+    """Queue depth, in-flight and shed counts per gate. Local requests only."""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify({name: gate.stats() for name, gate in admission_gates.items()}), 200
+
 # ==========================
 # Carrier Preferences Routes
 # ==========================
@@ -124,6 +471,365 @@ def get_conditions_json():
         logging.error(f"Error retrieving conditions: {e}")
         return jsonify({'error': 'Failed to retrieve conditions.'}), 500
 
+# ==========================
+# Static Quote Shards
+# ==========================
+# `flask --app app export-quote-shards` precomputes every /api/get_quotes
+# response into gzip shards named by the sha256 of their JSON, plus a
+# versioned manifest mapping request keys to shard hashes. current.json
+# points at the latest manifest; the shard directory can be served as-is by
+# any static file server, or by the routes below.
+QUOTE_SHARD_DIR = Path(os.environ.get("QUOTE_SHARD_DIR", "/home/ubuntu/scribe/quote/shards"))
+# /api/get_quotes only answers from shards when this is on, and only while the
+# current manifest is younger than QUOTE_SHARD_MAX_AGE_HOURS (0 = no limit).
+QUOTE_SHARDS_ENABLED = os.environ.get("QUOTE_SHARDS_ENABLED", "0").lower() in ("1", "true", "yes")
+QUOTE_SHARD_MAX_AGE_HOURS = float(os.environ.get("QUOTE_SHARD_MAX_AGE_HOURS", "24"))
+
+TERM_QUOTE_COLUMNS = [
+    "id", "face_amount", "sex", "term_length", "state", "age", "tobacco",
+    "company", "plan_name", "tier_name", "monthly_rate", "annual_rate",
+    "warnings", "logo_url", "eapp"
+]
+FEX_QUOTE_COLUMNS = [
+    "id", "face_amount", "sex", "state", "age", "tobacco", "underwriting_class",
+    "company", "plan_name", "tier_name", "monthly_rate", "annual_rate",
+    "warnings", "logo_url", "eapp"
+]
+
+# database -> (db_name, table, result columns, key columns)
+QUOTE_SOURCES = {
+    'term': ('term_quotes_db', 'term_quotes', TERM_QUOTE_COLUMNS,
+             ("face_amount", "sex", "age", "tobacco", "term_length")),
+    'fex': ('quotesdb', 'fex_quotes', FEX_QUOTE_COLUMNS,
+            ("face_amount", "sex", "age", "tobacco", "underwriting_class")),
+}
+
+_shard_manifest = {"mtime": None, "shards": {}, "generated_at": None, "stale_logged": False}
+
+
+def quote_shard_key(selected_database, key_values):
+    return "/".join([selected_database] + [str(v) for v in key_values])
+
+
+def encode_quote_shard(results):
+    """Serialize results the way jsonify does and gzip them deterministically."""
+    body = json.dumps(results, default=str, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(body).hexdigest(), gzip.compress(body, mtime=0)
+
+
+def write_quote_shard(out_dir, digest, payload):
+    path = out_dir / "shards" / digest[:2] / f"{digest}.json.gz"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(payload)
+        tmp.replace(path)
+    return path.relative_to(out_dir).as_posix()
+
+
+def export_quote_shards(out_dir, databases, keep=3):
+    """
+    Dump every key of the given databases to shards, publish a manifest and
+    prune all but the newest `keep` manifests and the shards they reference.
+    """
+    generated_at = datetime.datetime.utcnow()
+    shards = {}
+    for selected_database in databases:
+        db_name, table, columns, key_columns = QUOTE_SOURCES[selected_database]
+        key_idx = [columns.index(col) for col in key_columns]
+        query = (
+            f"SELECT {', '.join(columns)} FROM {table} "
+            f"ORDER BY {', '.join(key_columns)}, monthly_rate ASC, id"
+        )
+        conn = get_db_connection(db_name)
+        # Named cursor streams rows server-side instead of fetching the table.
+        cur = conn.cursor(name=f"export_{selected_database}")
+        cur.itersize = 10000
+        cur.execute(query)
+
+        current_key, results = None, []
+        for row in cur:
+            key = tuple(row[i] for i in key_idx)
+            if key != current_key and results:
+                digest, payload = encode_quote_shard(results)
+                shards[quote_shard_key(selected_database, current_key)] = write_quote_shard(out_dir, digest, payload)
+                results = []
+            current_key = key
+            results.append(dict(zip(columns, row)))
+        if results:
+            digest, payload = encode_quote_shard(results)
+            shards[quote_shard_key(selected_database, current_key)] = write_quote_shard(out_dir, digest, payload)
+
+        cur.close()
+        conn.close()
+        logging.info(f"[SHARDS] Exported {selected_database} keys (running total {len(shards)})")
+
+    # Timestamp plus a content hash: exports in the same second can't clobber
+    # each other's (immutable, long-cached) manifest.
+    shards_digest = hashlib.sha256(json.dumps(shards, sort_keys=True).encode('utf-8')).hexdigest()
+    version = f"{generated_at.strftime('%Y%m%dT%H%M%SZ')}-{shards_digest[:12]}"
+    manifest = {
+        "version": version,
+        "generated_at": generated_at.isoformat() + "Z",
+        "databases": list(databases),
+        "shards": shards
+    }
+    manifest_dir = out_dir / "manifests"
+    manifest_dir.mkdir(parents=True, exist_ok=True)
+    (manifest_dir / f"{version}.json").write_text(json.dumps(manifest))
+
+    # Swap current.json atomically so readers never see a partial manifest.
+    tmp = out_dir / "current.json.tmp"
+    tmp.write_text(json.dumps({"version": version, "manifest": f"manifests/{version}.json"}))
+    tmp.replace(out_dir / "current.json")
+
+    prune_quote_shards(out_dir, keep, current=f"{version}.json")
+    return manifest
+
+
+def prune_quote_shards(out_dir, keep, current):
+    """Delete manifests beyond the newest `keep` and shards none of them reference."""
+    manifests = sorted((out_dir / "manifests").glob("*.json"),
+                       key=lambda path: (path.name == current, path.stat().st_mtime_ns), reverse=True)
+    kept, stale = manifests[:max(keep, 1)], manifests[max(keep, 1):]
+    referenced = set()
+    for path in kept:
+        referenced.update(json.loads(path.read_text()).get("shards", {}).values())
+    for path in stale:
+        path.unlink(missing_ok=True)
+    removed = 0
+    for path in (out_dir / "shards").glob("*/*.json.gz"):
+        if path.relative_to(out_dir).as_posix() not in referenced:
+            path.unlink(missing_ok=True)
+            removed += 1
+    logging.info(f"[SHARDS] Pruned {len(stale)} manifests and {removed} shards (keeping {len(kept)})")
+
+
+@app.cli.command('export-quote-shards')
+@click.option('--out', 'out_dir', default=str(QUOTE_SHARD_DIR), help='Shard output directory.')
+@click.option('--database', 'databases', multiple=True, type=click.Choice(sorted(QUOTE_SOURCES)),
+              help='Database(s) to export; defaults to all.')
+@click.option('--keep', default=3, show_default=True, type=click.IntRange(min=1),
+              help='Manifests (and their shards) to retain for clients still on older versions.')
+def export_quote_shards_command(out_dir, databases, keep):
+    """Precompute /api/get_quotes results into static shards."""
+    manifest = export_quote_shards(Path(out_dir), databases or tuple(sorted(QUOTE_SOURCES)), keep)
+    click.echo(f"Wrote manifest {manifest['version']} with {len(manifest['shards'])} shards to {out_dir}")
+
+
+def load_quote_shard_manifest():
+    """
+    Return the current shard map, re-reading it only when current.json
+    changes. Returns {} (live SQL) when shard serving is off or the manifest
+    is older than QUOTE_SHARD_MAX_AGE_HOURS.
+    """
+    if not QUOTE_SHARDS_ENABLED:
+        return {}
+    current = QUOTE_SHARD_DIR / "current.json"
+    try:
+        mtime = current.stat().st_mtime
+    except OSError:
+        return {}
+    if mtime != _shard_manifest["mtime"]:
+        try:
+            pointer = json.loads(current.read_text())
+            manifest = json.loads((QUOTE_SHARD_DIR / pointer["manifest"]).read_text())
+            _shard_manifest["shards"] = manifest.get("shards", {})
+            _shard_manifest["generated_at"] = datetime.datetime.fromisoformat(manifest["generated_at"].rstrip("Z"))
+            _shard_manifest["stale_logged"] = False
+            logging.info(f"[SHARDS] Loaded manifest {pointer['version']} ({len(_shard_manifest['shards'])} shards)")
+        except Exception as e:
+            logging.error(f"[SHARDS] Error loading shard manifest: {e}")
+            _shard_manifest["shards"] = {}
+            _shard_manifest["generated_at"] = None
+        _shard_manifest["mtime"] = mtime
+
+    generated_at = _shard_manifest["generated_at"]
+    if QUOTE_SHARD_MAX_AGE_HOURS > 0 and generated_at is not None:
+        age_hours = (datetime.datetime.utcnow() - generated_at).total_seconds() / 3600
+        if age_hours > QUOTE_SHARD_MAX_AGE_HOURS:
+            if not _shard_manifest["stale_logged"]:
+                logging.warning(f"[SHARDS] Manifest is {age_hours:.1f}h old (max {QUOTE_SHARD_MAX_AGE_HOURS}h), "
+                                f"serving quotes from SQL until export-quote-shards is rerun")
+                _shard_manifest["stale_logged"] = True
+            return {}
+    return _shard_manifest["shards"]
+
+
+def quote_shard_path_for(data):
+    """Shard path for an unpaged /api/get_quotes body, or None to use live SQL."""
+    if (data.get('result_mode') or 'all') != 'all' or data.get('limit') not in (None, ''):
+        return None
+    selected_database = 'term' if data.get('selected_database', 'term') == 'term' else 'fex'
+    key_values = [
+        data.get('face_amount'), data.get('sex'), data.get('age'), data.get('tobacco'),
+        data.get('term_length') if selected_database == 'term' else data.get('underwriting_class')
+    ]
+    return load_quote_shard_manifest().get(quote_shard_key(selected_database, key_values))
+
+
+def quote_shard_response(shard_path):
+    payload = (QUOTE_SHARD_DIR / shard_path).read_bytes()
+    if request.accept_encodings['gzip'] > 0:
+        response = Response(payload, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(gzip.decompress(payload), mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['X-Quote-Source'] = 'shard'
+    return response
+
+
+@app.route('/api/quote_shards/current.json', methods=['GET'])
+def get_quote_shard_pointer():
+    response = send_from_directory(QUOTE_SHARD_DIR, 'current.json', mimetype='application/json')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+QUOTE_SHARD_FILE_RE = re.compile(r"manifests/[0-9TZ]+-[0-9a-f]{12}\.json|shards/[0-9a-f]{2}/[0-9a-f]{64}\.json\.gz")
+
+
+@app.route('/api/quote_shards/<path:name>', methods=['GET'])
+def get_quote_shard_file(name):
+    """Manifests and shards are immutable once written, so cache them forever."""
+    if not QUOTE_SHARD_FILE_RE.fullmatch(name):
+        return jsonify({'error': 'Not found'}), 404
+    response = send_from_directory(QUOTE_SHARD_DIR, name)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+# ==========================
+# Quote Result Modes
+# ==========================
+# 'all' returns every matching tier. 'best_per_carrier' keeps only each
+# carrier's cheapest tier and 'top_k' the k cheapest tiers overall; both are
+# paged with an opaque cursor over (declined, monthly_rate, id). Cursors are
+# scoped to the request key and mode so they can't be replayed elsewhere.
+RESULT_MODES = ('all', 'best_per_carrier', 'top_k')
+DEFAULT_PAGE_SIZE = 10
+DEFAULT_TOP_K = 10
+MAX_PAGE_SIZE = 100
+
+
+def quote_cursor_scope(selected_database, key_values, result_mode, k=None,
+                       selected_carriers=None, declined_carriers=()):
+    scope = json.dumps([
+        'term' if selected_database == 'term' else 'fex',
+        [str(v) for v in key_values], result_mode, k,
+        sorted(selected_carriers or []), sorted(declined_carriers)
+    ])
+    return hashlib.sha256(scope.encode('utf-8')).hexdigest()[:16]
+
+
+def encode_quote_cursor(scope, declined, monthly_rate, quote_id):
+    raw = json.dumps([scope, declined, str(monthly_rate), quote_id], default=str)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_quote_cursor(cursor, scope):
+    """Return (declined, monthly_rate, id). Raises ValueError on a bad or foreign cursor."""
+    try:
+        cursor_scope, declined, monthly_rate, quote_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii'))
+        )
+    except (ValueError, TypeError):
+        raise ValueError("Malformed cursor")
+    if cursor_scope != scope:
+        raise ValueError("cursor does not belong to this query")
+    return bool(declined), monthly_rate, quote_id
+
+
+def parse_bounded_int(name, value, default):
+    if value in (None, ''):
+        return default
+    value = int(value)
+    if not 1 <= value <= MAX_PAGE_SIZE:
+        raise ValueError(f"{name} must be between 1 and {MAX_PAGE_SIZE}")
+    return value
+
+
+def parse_result_mode(result_mode, limit, cursor, k=None):
+    """
+    Validate paging inputs and return (result_mode, limit, k, cursor). The
+    cursor is returned still encoded; decode it with decode_quote_cursor once
+    the query scope is known. Raises ValueError on bad values.
+    """
+    result_mode = result_mode or 'all'
+    if result_mode not in RESULT_MODES:
+        raise ValueError(f"Invalid result_mode '{result_mode}'")
+    limit = parse_bounded_int('limit', limit, None if result_mode == 'all' else DEFAULT_PAGE_SIZE)
+    k = parse_bounded_int('k', k, DEFAULT_TOP_K) if result_mode == 'top_k' else None
+    if cursor in (None, ''):
+        cursor = None
+    elif not isinstance(cursor, str):
+        raise ValueError("cursor must be a string")
+    elif limit is None:
+        raise ValueError("cursor requires a limit")
+    return result_mode, limit, k, cursor
+
+
+def build_quote_query(selected_database, key_values, selected_carriers=None, declined_carriers=(),
+                      result_mode='all', limit=None, cursor=None, k=None):
+    """
+    Build the quote SELECT for a database. Rows come back in display order:
+    declined carriers after the rest, then by monthly_rate. With a limit,
+    one extra row is fetched so the caller can tell whether a next page exists.
+    `cursor` is a decoded (declined, monthly_rate, id) tuple.
+    """
+    source = 'term' if selected_database == 'term' else 'fex'
+    db_name, table, columns, key_columns = QUOTE_SOURCES[source]
+    column_list = ', '.join(columns)
+    declined_carriers = list(declined_carriers)
+
+    where = [f"{col} = %s" for col in key_columns]
+    params = list(key_values)
+    if selected_carriers:
+        where.append("company = ANY(%s)")
+        params.append(list(selected_carriers))
+    if limit is not None:
+        # Rate-less rows are never shown and can't be compared by the cursor.
+        where.append("monthly_rate IS NOT NULL")
+
+    if result_mode == 'best_per_carrier':
+        inner = (
+            f"SELECT DISTINCT ON (company) {column_list} FROM {table} "
+            f"WHERE {' AND '.join(where)} ORDER BY company, monthly_rate ASC, id"
+        )
+    elif result_mode == 'top_k':
+        inner = (
+            f"SELECT {column_list} FROM {table} WHERE {' AND '.join(where)} "
+            f"ORDER BY (company = ANY(%s)), monthly_rate ASC, id LIMIT %s"
+        )
+        params.extend([declined_carriers, k])
+    else:
+        inner = f"SELECT {column_list} FROM {table} WHERE {' AND '.join(where)}"
+
+    query = f"SELECT {column_list} FROM ({inner}) quotes"
+    if cursor is not None:
+        query += " WHERE ((company = ANY(%s)), monthly_rate, id) > (%s, %s, %s)"
+        params.extend([declined_carriers, *cursor])
+    query += " ORDER BY (company = ANY(%s)), monthly_rate ASC, id"
+    params.append(declined_carriers)
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit + 1)
+    return db_name, query, params, columns
+
+
+def paginate_quote_rows(rows, columns, declined_carriers, limit, scope):
+    """Trim the look-ahead row and return (rows, next_cursor)."""
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    company = last[columns.index('company')]
+    next_cursor = encode_quote_cursor(
+        scope, company in declined_carriers, last[columns.index('monthly_rate')], last[columns.index('id')]
+    )
+    return rows, next_cursor
+
+
 # NEW ENDPOINT: Get Quotes as JSON (for iOS)
 @app.route('/api/get_quotes', methods=['POST'])
 def get_quotes_api():
@@ -137,36 +843,32 @@ def get_quotes_api():
         term_length = data.get('term_length')
         underwriting_class = data.get('underwriting_class')
 
-        if selected_database == 'term':
-            db_name = 'term_quotes_db'
-            query = """
-                SELECT id, face_amount, sex, term_length, state, age, tobacco,
-                       company, plan_name, tier_name, monthly_rate, annual_rate,
-                       warnings, logo_url, eapp
-                FROM term_quotes
-                WHERE face_amount = %s
-                  AND sex = %s
-                  AND age = %s
-                  AND tobacco = %s
-                  AND term_length = %s
-                ORDER BY monthly_rate ASC
-            """
-            params = [face_amount, sex, age, tobacco, term_length]
-        else:
-            db_name = 'quotesdb'
-            query = """
-                SELECT id, face_amount, sex, state, age, tobacco, underwriting_class,
-                       company, plan_name, tier_name, monthly_rate, annual_rate,
-                       warnings, logo_url, eapp
-                FROM fex_quotes
-                WHERE face_amount = %s
-                  AND sex = %s
-                  AND age = %s
-                  AND tobacco = %s
-                  AND underwriting_class = %s
-                ORDER BY monthly_rate ASC
-            """
-            params = [face_amount, sex, age, tobacco, underwriting_class]
+        key_values = [
+            face_amount, sex, age, tobacco,
+            term_length if selected_database == 'term' else underwriting_class
+        ]
+
+        try:
+            result_mode, limit, k, cursor = parse_result_mode(
+                data.get('result_mode'), data.get('limit'), data.get('cursor'), data.get('k')
+            )
+            scope = quote_cursor_scope(selected_database, key_values, result_mode, k)
+            if cursor is not None:
+                cursor = decode_quote_cursor(cursor, scope)
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": f"Invalid paging parameters: {e}"}), 400
+
+        if limit is None:
+            shard_path = quote_shard_path_for(data)
+            if shard_path:
+                try:
+                    return quote_shard_response(shard_path)
+                except OSError as e:
+                    logging.warning(f"[SHARDS] Shard {shard_path} unreadable, falling back to SQL: {e}")
+
+        db_name, query, params, columns = build_quote_query(
+            selected_database, key_values, result_mode=result_mode, limit=limit, cursor=cursor, k=k
+        )
 
         conn = get_db_connection(db_name)
         cur = conn.cursor()
@@ -175,48 +877,11 @@ def get_quotes_api():
         cur.close()
         conn.close()
 
-        results = []
-        if selected_database == 'term':
-            for row in rows:
-                result = {
-                    "id": row[0],
-                    "face_amount": row[1],
-                    "sex": row[2],
-                    "term_length": row[3],
-                    "state": row[4],
-                    "age": row[5],
-                    "tobacco": row[6],
-                    "company": row[7],
-                    "plan_name": row[8],
-                    "tier_name": row[9],
-                    "monthly_rate": row[10],
-                    "annual_rate": row[11],
-                    "warnings": row[12],
-                    "logo_url": row[13],
-                    "eapp": row[14]
-                }
-                results.append(result)
-        else:
-            for row in rows:
-                result = {
-                    "id": row[0],
-                    "face_amount": row[1],
-                    "sex": row[2],
-                    "state": row[3],
-                    "age": row[4],
-                    "tobacco": row[5],
-                    "underwriting_class": row[6],
-                    "company": row[7],
-                    "plan_name": row[8],
-                    "tier_name": row[9],
-                    "monthly_rate": row[10],
-                    "annual_rate": row[11],
-                    "warnings": row[12],
-                    "logo_url": row[13],
-                    "eapp": row[14]
-                }
-                results.append(result)
-        return jsonify(results)
+        rows, next_cursor = paginate_quote_rows(rows, columns, (), limit, scope)
+        results = [dict(zip(columns, row)) for row in rows]
+        if limit is None:
+            return jsonify(results)
+        return jsonify({"results": results, "next_cursor": next_cursor})
     except Exception as e:
         logging.error(f"Error processing quotes: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
@@ -289,21 +954,75 @@ def get_condition_questions_json():
 # ==========================
 CSV_PATH = os.path.join(app.root_path, 'templates', 'uwrules.csv')
 
+
+class ConditionTable:
+    """
+    Column-oriented, read-only view of uwrules.csv built with the stdlib csv
+    module. Rows are addressed by position; (Condition, Treatment_Date) is
+    hash-indexed so the CSV endpoints never scan the table.
+    """
+
+    __slots__ = ('columns', 'data', 'carrier_columns', 'conditions', 'by_condition_date')
+
+    def __init__(self, columns=(), rows=()):
+        self.columns = [col.strip() for col in columns]
+        self.data = {col: [] for col in self.columns}
+        self.carrier_columns = [col for col in self.columns if col.startswith('Carrier_')]
+        self.conditions = []          # unique conditions, in file order
+        self.by_condition_date = {}   # (condition, treatment_date) -> first row index
+        seen = set()
+
+        width = len(self.columns)
+        for idx, row in enumerate(rows):
+            # Pad short rows (and trim long ones) so every column stays row-aligned.
+            row = (list(row) + [''] * width)[:width]
+            for col, value in zip(self.columns, row):
+                self.data[col].append(value if value != '' else None)
+            condition = self.value('Condition', idx)
+            if condition is None:
+                continue
+            if condition not in seen:
+                seen.add(condition)
+                self.conditions.append(condition)
+            self.by_condition_date.setdefault((condition, self.value('Treatment_Date', idx)), idx)
+
+    @classmethod
+    def from_csv(cls, path):
+        # utf-8-sig drops the BOM Excel puts in front of the first header.
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            return cls(header, reader)
+
+    def value(self, column, idx):
+        values = self.data.get(column)
+        return values[idx] if values is not None else None
+
+    def find(self, condition, treatment_date):
+        """Return the first row index matching both keys, or None."""
+        if treatment_date is not None:
+            treatment_date = str(treatment_date)
+        return self.by_condition_date.get((condition, treatment_date))
+
+    def carrier_statuses(self, idx):
+        return {col.replace('Carrier_', ''): self.value(col, idx) for col in self.carrier_columns}
+
+
 try:
-    df_csv = pd.read_csv(CSV_PATH)
-    df_csv.columns = df_csv.columns.str.strip()
-    conditions_list_csv = df_csv['Condition'].dropna().unique().tolist()
-    conditions_lower_csv = [condition.lower() for condition in conditions_list_csv]
+    condition_table = ConditionTable.from_csv(CSV_PATH)
     logging.info("Health conditions CSV loaded successfully")
 except Exception as e:
     logging.error(f"Error loading health conditions CSV: {e}")
-    df_csv = pd.DataFrame()
+    condition_table = ConditionTable()
+
+conditions_list_csv = condition_table.conditions
+conditions_lower_csv = [condition.lower() for condition in conditions_list_csv]
 
 @app.route('/api/conditions_csv', methods=['GET'])
 def get_conditions_csv():
     """Return conditions from the CSV."""
     try:
-        conditions = df_csv['Condition'].unique().tolist()
+        conditions = conditions_list_csv
         logging.info(f"Retrieved {len(conditions)} conditions from CSV")
         return jsonify({'conditions': conditions}), 200
     except Exception as e:
@@ -339,21 +1058,12 @@ def check_eligibility_csv():
 
         logging.info(f"Checking eligibility for: {condition}, date: {treatment_date}")
 
-        condition_data = df_csv[
-            (df_csv['Condition'] == condition) &
-            (df_csv['Treatment_Date'] == treatment_date)
-        ]
+        row_idx = condition_table.find(condition, treatment_date)
 
-        if condition_data.empty:
+        if row_idx is None:
             return jsonify({'error': 'No matching conditions found'}), 404
 
-        carrier_columns = [col for col in df_csv.columns if col.startswith('Carrier_')]
-        results = {}
-
-        for carrier in carrier_columns:
-            carrier_name = carrier.replace('Carrier_', '')
-            status = condition_data[carrier].iloc[0]
-            results[carrier_name] = status
+        results = condition_table.carrier_statuses(row_idx)
 
         return jsonify(results), 200
     except Exception as e:
@@ -410,13 +1120,48 @@ def evaluate_rule_json():
 # ==========================
 # Quote Search Functions
 # ==========================
+def evaluate_carrier_statuses(medical_conditions, medical_responses):
+    """
+    Fold the answered conditions into one (approval_status, complete_rule)
+    per carrier. Any decline wins over approvals; the last non-empty
+    reason/completeRule is kept for the tooltip.
+    """
+    found = {}  # carrier -> [found_decline, found_approval, complete_rule]
+    for condKey, condData in medical_conditions.items():
+        if condKey not in medical_responses:
+            continue
+        for cRes in condData.get('carriersResult', []):
+            # JSON has "company" for the carrier
+            entry = found.setdefault(cRes.get('company'), [False, False, ""])
+            status_lower = cRes.get('status', "UNKNOWN APPROVAL").strip().lower()
+            if status_lower in ("decline", "declined"):
+                entry[0] = True
+            elif status_lower == "approved":
+                entry[1] = True
+            reason_text = cRes.get('reason', "") or cRes.get('completeRule', "")
+            if reason_text:
+                entry[2] = reason_text
+
+    statuses = {}
+    for carrier, (found_decline, found_approval, complete_rule) in found.items():
+        if found_decline:
+            approval_status = "Decline"
+        elif found_approval:
+            approval_status = "Approved"
+        else:
+            approval_status = "UNKNOWN APPROVAL"
+        statuses[carrier] = (approval_status, complete_rule)
+    return statuses
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     start_time = time.time()
     logging.info("[TIMER] Starting index() route")
 
     results = None
+    next_cursor = None
     face_amount = sex = age = tobacco = underwriting_class = term_length = selected_database = None
+    result_mode = request.form.get('result_mode', 'all')
     medical_conditions = {}
     medical_responses = {}
     location_id = request.args.get('locationID') or request.form.get('locationID')
@@ -469,43 +1214,38 @@ def index():
                 face_amount, sex, age, tobacco, selected_database, underwriting_class, term_length
             )
 
-            db_name = 'term_quotes_db' if selected_database == 'term' else 'quotesdb'
+            # The cursor is checked separately below: a stale one just restarts paging.
+            result_mode, limit, k, _ = parse_result_mode(
+                result_mode, request.form.get('limit'), None, request.form.get('k')
+            )
+
+            # Carrier approval only depends on the carrier, so resolve it up front
+            # and let Postgres put declined carriers last.
+            carrier_statuses = evaluate_carrier_statuses(medical_conditions, medical_responses)
+            declined_carriers = {carrier for carrier, (status, _) in carrier_statuses.items() if status == "Decline"}
+
+            key_values = [
+                face_amount, sex, age, tobacco,
+                term_length if selected_database == 'term' else underwriting_class
+            ]
+            scope = quote_cursor_scope(selected_database, key_values, result_mode, k,
+                                       selected_carriers, declined_carriers)
+            cursor = None
+            raw_cursor = request.form.get('cursor')
+            if raw_cursor and limit is not None:
+                try:
+                    cursor = decode_quote_cursor(raw_cursor, scope)
+                except ValueError as e:
+                    # Form or carrier preferences changed since the page was rendered.
+                    logging.info(f"[index POST] Ignoring cursor ({e}), showing first page")
+            db_name, query, params, columns = build_quote_query(
+                selected_database, key_values,
+                selected_carriers=selected_carriers,
+                declined_carriers=sorted(declined_carriers),
+                result_mode=result_mode, limit=limit, cursor=cursor, k=k
+            )
             conn = get_db_connection(db_name)
             cur = conn.cursor()
-
-            # Build the correct query
-            if selected_database == 'term':
-                query = """
-                    SELECT id, face_amount, sex, term_length, state, age, tobacco,
-                           company, plan_name, tier_name, monthly_rate, annual_rate,
-                           warnings, logo_url, eapp
-                    FROM term_quotes
-                    WHERE face_amount = %s
-                    AND sex = %s
-                    AND age = %s
-                    AND tobacco = %s
-                    AND term_length = %s
-                """
-                params = [face_amount, sex, age, tobacco, term_length]
-            else:
-                query = """
-                    SELECT id, face_amount, sex, state, age, tobacco, underwriting_class,
-                           company, plan_name, tier_name, monthly_rate, annual_rate,
-                           warnings, logo_url, eapp
-                    FROM fex_quotes
-                    WHERE face_amount = %s
-                    AND sex = %s
-                    AND age = %s
-                    AND tobacco = %s
-                    AND underwriting_class = %s
-                """
-                params = [face_amount, sex, age, tobacco, underwriting_class]
-
-            if selected_carriers:
-                query += " AND company = ANY(%s)"
-                params.append(selected_carriers)
-
-            query += " ORDER BY monthly_rate ASC"
             db_query_time = time.time()
             logging.info(f"[TIMER] Building query took {db_query_time - parse_time:.2f} seconds")
 
@@ -518,85 +1258,30 @@ def index():
             results = cur.fetchall()
             results_fetch_end = time.time()
             logging.info(f"[TIMER] Fetching results took {results_fetch_end - results_fetch_start:.2f} seconds")
-            logging.info("[index POST] Found %d matching quotes", len(results))
+            logging.info("[index POST] Found %d matching quotes (mode=%s)", len(results), result_mode)
 
             cur.close()
             conn.close()
-            
-            # Process results with medical conditions
+
+            results, next_cursor = paginate_quote_rows(results, columns, declined_carriers, limit, scope)
+
+            # Rows are already in display order; just attach approval info.
             processed_results = []
             for idx, row in enumerate(results):
                 row_list = list(row)
-                
-                carrier_name = row_list[7]
-                logging.info("[index POST] Processing carrier: %s", carrier_name)
-
-                approval_status = "UNKNOWN APPROVAL"
-                complete_rule = ""
-                found_decline = False
-                found_approval = False
-
-                # Evaluate each condition
-                for condKey, condData in medical_conditions.items():
-                    if condKey in medical_responses:
-                        carrier_results = condData.get('carriersResult', [])
-                        for cRes in carrier_results:
-                            # JSON has "company" for the carrier
-                            json_carrier = cRes.get('company')
-                            if json_carrier == carrier_name:
-                                status = cRes.get('status', "UNKNOWN APPROVAL")
-                                # We'll store either 'reason' or 'completeRule' for the tooltip
-                                reason_text = cRes.get('reason', "")
-                                if not reason_text:
-                                    reason_text = cRes.get('completeRule', "")
-
-                                logging.info("[index POST] Found status=%s, reason=%s for %s",
-                                             status, reason_text, carrier_name)
-
-                                # If the JSON uses 'Decline' -> we set found_decline
-                                # If the JSON uses 'Approved' -> found_approval
-                                # (If you have 'Declined', you might also want to handle that.)
-                                status_lower = status.strip().lower()
-                                if status_lower in ("decline", "declined"):
-                                    found_decline = True
-                                elif status_lower == "approved":
-                                    found_approval = True
-
-                                if reason_text:
-                                    complete_rule = reason_text
-
-                # Decide final approval_status
-                if found_decline:
-                    approval_status = "Decline"
-                elif found_approval:
-                    approval_status = "Approved"
-                else:
-                    approval_status = "UNKNOWN APPROVAL"
 
                 # Ensure row_list has at least 15 elements
                 while len(row_list) < 15:
                     row_list.append(None)
 
                 # Append approval_status (index 15) and complete_rule (index 16)
+                approval_status, complete_rule = carrier_statuses.get(row_list[7], ("UNKNOWN APPROVAL", ""))
                 row_list.append(approval_status)
                 row_list.append(complete_rule)
 
-                logging.info("[index POST] Row %d final status (row_list[15]) is: %s", idx, row_list[15])
                 logging.debug("[index POST] Row %d: %s", idx, row_list)
                 processed_results.append(tuple(row_list))
 
-            def parse_rate(row):
-                try:
-                    return float(row[10])  # monthly_rate is at index 10
-                except:
-                    return 999999  # fallback if missing/invalid
-
-            # Sort so that Declines appear after Approvals, and within each group we sort by monthly_rate
-            processed_results.sort(key=lambda r: (
-                r[15] == 'Decline',  # True sorts after False
-                parse_rate(r)
-            ))
-
             logging.info("[index POST] Finished processing results")
             processing_done = time.time()
             logging.info(f"[TIMER] Processing results took {processing_done - results_fetch_end:.2f} seconds")
@@ -620,7 +1305,9 @@ def index():
         term_length=term_length,
         selected_database=selected_database,
         medical_conditions=medical_conditions,
-        medical_responses=medical_responses
+        medical_responses=medical_responses,
+        result_mode=result_mode,
+        next_cursor=next_cursor
     )
     final_render_end = time.time()
     logging.info(f"[TIMER] Final render took {final_render_end - final_render_start:.2f} seconds")